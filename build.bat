@@ -8,6 +8,7 @@ pyinstaller main.py --onedir --windowed --icon=icons/icon.ico ^
 --add-data "icons/pen.png;icons" ^
 --add-data "icons/eraser.png;icons" ^
 --name=Toggle-Untoggle ^
+--hidden-import imagecodecs ^
 --exclude-module PyQt6.QtMultimedia ^
 --exclude-module PyQt6.QtWebEngineWidgets ^
 --exclude-module PyQt6.QtMultimediaWidgets ^
@@ -2,13 +2,13 @@ import numpy as np
 import pandas as pd
 import cv2
 import os
+import re
+import tifffile
 import warnings
 warnings.filterwarnings("ignore")
 
-from PIL import Image
 from skimage import measure, segmentation
-from skimage.segmentation import find_boundaries
-from skimage.morphology import dilation, disk
+from skimage.morphology import disk
 from PyQt6.QtGui import QPixmap, QImage
 
 
@@ -29,25 +29,73 @@ def open_folder(image_folder, ids_list):
     Putting sets of TIFF images needed for segmentation in the dictionary
     """
     image_dict = {}
-    delete_dot_underscore_files(image_folder)
     if not os.path.isdir(image_folder):
         return image_dict
-    # Iterating through all files in the directory
-    for filename in os.listdir(image_folder):
-        if filename.lower().endswith(('.tif', '.tiff')) and any(id in filename for id in ids_list):  # Extracting all tif files
-            file_path = os.path.join(image_folder, filename)
-            # Adding a filename as key and an image path as value to the dictionary
-            image_dict[filename] = file_path
+    ids_pattern = re.compile('|'.join(re.escape(id) for id in ids_list)) if ids_list else None  # matching any of the identifiers in a single search
+    # Iterating through all files in the directory; hidden files are deleted in the same pass
+    with os.scandir(image_folder) as entries:
+        for entry in entries:
+            filename = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                delete_dot_underscore_files(entry.path)  # subdirectories are still cleaned up recursively
+            elif filename.startswith("."):
+                os.remove(entry.path)
+                print(f"Deleted: {entry.path}")
+            elif ids_pattern and filename.lower().endswith(('.tif', '.tiff')) and ids_pattern.search(filename):  # Extracting all tif files
+                # Adding a filename as key and an image path as value to the dictionary
+                image_dict[filename] = entry.path
     return image_dict
 
 
+def histogram_percentiles(image, percents):
+    """
+    Percentiles of an 8/16-bit unsigned integer image read from its cumulative histogram
+    instead of sorting the pixels (same linear interpolation as np.percentile)
+    """
+    cdf = np.cumsum(np.bincount(image.ravel()))
+    quantiles = np.asarray(percents, dtype=np.float64) / 100
+    positions = image.size * quantiles + (1 - quantiles) - 1  # positions in the sorted pixel values
+    below = np.floor(positions)
+    fraction = positions - below
+    below = below.astype(np.int64)
+    above = np.minimum(below + 1, image.size - 1)
+    # the k-th smallest pixel value is the first intensity whose cumulative count exceeds k
+    value_below = np.searchsorted(cdf, below, side='right').astype(np.float64)
+    value_above = np.searchsorted(cdf, above, side='right').astype(np.float64)
+    diff = value_above - value_below
+    return np.where(fraction >= 0.5, value_above - diff * (1 - fraction), value_below + diff * fraction)
+
+
+def read_tiff(image_path):
+    """
+    Read the first page of a TIFF file; uncompressed files are memory-mapped instead of copied into RAM.
+    Always returns native byte order, since OpenCV ignores the byte order of an array
+    """
+    try:
+        image = tifffile.memmap(image_path, page=0, mode='r')
+    except ValueError:  # compressed pages can not be memory-mapped
+        return tifffile.imread(image_path, key=0)
+    if not image.dtype.isnative:  # big-endian files (e.g. ImageJ "MM" TIFFs) are mapped as stored
+        image = image.astype(image.dtype.newbyteorder('='))
+    return image
+
+
 def increase_contrast_stretch(image, low_percent, high_percent):
     """
     Increasing the contrast of the images for display in color using clipping
     """
-    p_low = np.percentile(image, low_percent)
-    p_high = np.percentile(image, high_percent)
-    return np.clip((image - p_low) / (p_high - p_low), 0, 1)
+    if image.dtype in (np.uint8, np.uint16):
+        p_low, p_high = histogram_percentiles(image, [low_percent, high_percent])
+    else:
+        p_low, p_high = np.percentile(image, [low_percent, high_percent])  # both percentiles from a single partition of the image
+    # 8-bit images: stretching the 256 possible values once and mapping the pixels through a lookup table
+    values = np.arange(256, dtype=np.uint8) if image.dtype == np.uint8 else image
+    stretched = np.subtract(values, p_low, dtype=np.float32)  # converting to float32 and shifting in the same pass
+    stretched *= 1 / (p_high - p_low)
+    np.clip(stretched, 0, 1, out=stretched)
+    if image.dtype == np.uint8:
+        return cv2.LUT(image, stretched)
+    return stretched
 
 
 def pixel_conversion(big_df, pixel_rate):
@@ -55,13 +103,14 @@ def pixel_conversion(big_df, pixel_rate):
     Pixel to micron conversion for the final df
     """
     area_rate = pixel_rate ** 2
-    for col in ['area', 'bbox_area', 'area_convex']:
-        if col in big_df:
-            big_df[col] *= area_rate
-    for col in ['perimeter', 'major_axis_length', 'minor_axis_length',
-                    'equivalent_diameter_area', 'feret_diameter_max', 'perimeter_crofton']:
-        if col in big_df:
-            big_df[col] *= pixel_rate
+    # scaling each group of columns with a single multiplication
+    area_cols = [col for col in ['area', 'bbox_area', 'area_convex'] if col in big_df]
+    length_cols = [col for col in ['perimeter', 'major_axis_length', 'minor_axis_length',
+                    'equivalent_diameter_area', 'feret_diameter_max', 'perimeter_crofton'] if col in big_df]
+    if area_cols:
+        big_df[area_cols] = big_df[area_cols].to_numpy(dtype=float) * area_rate
+    if length_cols:
+        big_df[length_cols] = big_df[length_cols].to_numpy(dtype=float) * pixel_rate
     return big_df
 
 
@@ -101,42 +150,46 @@ def image_preprocessing(main_marker_image_path,
         - nucleus_image (np.ndarray): Raw nucleus image. 
         - diam_pixels (float): Estimated diameter in pixels (used by Cellpose segmentation)
         - marker_channel (int): Index of the RGB channel used for segmentation.
-        - rgb_image (np.ndarray): Preprocessed 2-channel color image
+        - rgb_image (np.ndarray): Preprocessed 2-channel color image (uint8)
     If `nucleus_channel_present` is False:
         - main_marker_image (np.ndarray): Raw segmentation image.
         - diam_pixels (float): Estimated diameter in pixels.
         - marker_channel (int): Index (color) of the RGB channel used for segmentation.
-        - rgb_image (np.ndarray): Preprocessed 1-channel color image
+        - rgb_image (np.ndarray): Preprocessed 1-channel color image (uint8)
 
     Returns None if the image is considered empty (not enough non-background signal).
     """
-    # opening the image file using PIL and converting it to an array
-    main_marker_opened = Image.open(main_marker_image_path)
-    main_marker_image = np.array(main_marker_opened)
-    
-    # increasing the contrast of the segmentation channel image
-    main_marker_im = increase_contrast_stretch(main_marker_image, main_marker_contrast_low, main_marker_contrast_high)
+    # reading the first page of the image file straight into an array
+    main_marker_image = read_tiff(main_marker_image_path)
     
     # counting non-black pixels (see if the minimumm amount of pixels have the intensity above the threshold); skipping the images if the image is empty
-    height, width = main_marker_im.shape
-    rgb_image = np.zeros((height, width, 3))
+    # (done before any contrast stretching so that empty images are discarded as cheaply as possible)
+    height, width = main_marker_image.shape
     total_image_area = height * width
-    non_black_pixel_count = np.sum(main_marker_image > intensity_threshold)
+    # cv2.compare ignores the byte order of the array, so it must be native (a no-op for read_tiff output)
+    native_image = np.asarray(main_marker_image, dtype=main_marker_image.dtype.newbyteorder('='))
+    non_black_pixel_count = cv2.countNonZero(cv2.compare(native_image, intensity_threshold, cv2.CMP_GT))
     if non_black_pixel_count < (min_non_black_pixels_percentage / 100) * total_image_area:  # converting the % specified by the user into a pixel number
         return None
     
+    # increasing the contrast of the segmentation channel image
+    main_marker_im = increase_contrast_stretch(main_marker_image, main_marker_contrast_low, main_marker_contrast_high)
+    rgb_image = np.zeros((height, width, 3), dtype=np.uint8)
+
     # assigning color to the segmentation marker image
     if main_marker_channel == 'red':
         marker_channel = 0
     elif main_marker_channel=='green':
         marker_channel = 1
-    rgb_image[..., marker_channel] = main_marker_im 
+    # scaling in place and letting the channel assignment do the float -> uint8 conversion (no temporaries)
+    main_marker_im *= 255
+    rgb_image[..., marker_channel] = main_marker_im
     diam_pixels = diam / pixel_conv_rate # converting microns specified by the user in pixels
 
     if nucleus_channel_present:
-        nucleus_opened = Image.open(nucleus_image_path)
-        nucleus_image = np.array(nucleus_opened) 
+        nucleus_image = read_tiff(nucleus_image_path)
         nucleus_im = increase_contrast_stretch(nucleus_image, nucleus_contrast_low, nucleus_contrast_high)
+        nucleus_im *= 255
         rgb_image[..., 2] = nucleus_im  # blue channel for the nucleus
         return main_marker_image, nucleus_image, diam_pixels, marker_channel, rgb_image
     else:
@@ -168,7 +221,7 @@ def analyze_segmented_cells(predicted_masks,
     - main_marker_image_name (str): Name of the segmentation image.
     - min_area (float): Minimum area (in µm²) to consider an object a cell
     - pixel_conv_rate (float): Conversion factor from pixels to microns.
-    - rgb_image (np.ndarray): RGB image used for generating the overlay.
+    - rgb_image (np.ndarray): uint8 RGB image used for generating the overlay.
     - condition_name (str): Experimental condition name.
     - replicate_num (int): Replicate number.
     - nucleus_image (np.ndarray, optional): Image containing nuclear marker.
@@ -181,65 +234,69 @@ def analyze_segmented_cells(predicted_masks,
     - temp_df (pd.DataFrame): DataFrame of valid cell properties.
     - overlay_image (np.ndarray): RGB image with boundaries of selected cells.
     - gray_image (np.ndarray): Grayscale image from the original RGB.
-    - mask_list (list): List of dictionaries with binary masks of individual cells.
+    - mask_list (list): List of dictionaries with the bounding-box binary masks of individual cells.
     """
 
     labeled_mask = measure.label(predicted_masks)
     cleared_mask = segmentation.clear_border(labeled_mask)
-        
-    valid_props = []
-    valid_regions = []
+
+    # counting the pixels of every object (and its nucleus pixels) in a single pass over the image
+    labels_flat = cleared_mask.ravel()
+    region_areas = np.bincount(labels_flat, minlength=cleared_mask.max() + 1)
+    valid_labels = region_areas > (min_area / pixel_conv_rate**2) # making sure that the area of the cell is above the minimum
+
+    if nucleus_channel_present: # making sure that the size and the brightness of the nucleus is sufficient for the cell to be considered an object
+        region_nucleus_pixels = np.bincount(labels_flat, weights=(nucleus_image >= nucleus_pixel_threshold).ravel(), minlength=len(region_areas))
+        min_required_nucleus_pixels = (min_nucleus_pixels_percentage / 100) * region_areas
+        valid_labels &= region_nucleus_pixels >= min_required_nucleus_pixels
+    valid_labels[0] = False # background
+
+    # only measuring the objects that passed the filters, relabelled 1..N with a single lookup-table gather
+    label_lut = np.zeros(len(valid_labels), dtype=cleared_mask.dtype)
+    label_lut[valid_labels] = np.arange(1, np.count_nonzero(valid_labels) + 1)
+    filtered_mask = label_lut[cleared_mask]
+
+    # measuring all the remaining objects at once (one array per property)
+    valid_props = measure.regionprops_table(filtered_mask, intensity_image=main_marker_image, properties=properties)
+
     mask_list = []  # list that is eventually populated with dictionaries for individual objects
-    new_label_counter = 1 # making sure mask labeling starts with 1 after filtering
-
-    for region in measure.regionprops(cleared_mask, intensity_image=main_marker_image):
-        region_mask = (cleared_mask == region.label) # extracting a binary mask for the current region
-        region_area = region.area 
-        valid = region_area > (min_area / pixel_conv_rate**2) # making sure that the cell of the cell is above the minimum
-
-        if nucleus_channel_present: # making sure that the size and the brightness of the nucleus is sufficient for the cell to be considered an object
-            min_required_nucleus_pixels = (min_nucleus_pixels_percentage / 100) * region_area
-            nucleus_pixels = nucleus_image[region_mask]
-            region_nucleus_pixels = np.sum(nucleus_pixels >= nucleus_pixel_threshold)
-            valid = valid and (region_nucleus_pixels >= min_required_nucleus_pixels)
-
-        if valid:
-            props = {prop: getattr(region, prop) for prop in properties}
-            valid_props.append(props)
-            valid_regions.append(region)
-            mask_list.append({
-                "image_name": main_marker_image_name,
-                "label": new_label_counter,
-                "mask": region_mask
-            })
-            new_label_counter += 1
+    # each object keeps only the binary mask inside its bounding box (see expand_mask for the full-size mask)
+    for new_label, region in enumerate(measure.regionprops(filtered_mask), start=1): # making sure mask labeling starts with 1 after filtering
+        mask_list.append({
+            "image_name": main_marker_image_name,
+            "label": new_label,
+            "mask": region.image,
+            "bbox": region.bbox,
+            "shape": filtered_mask.shape
+        })
     
     # generating grayscale image for further mask overlay
-    rgb_image_copy = rgb_image.copy()
-    if rgb_image_copy.dtype != np.uint8:
-        rgb_image_copy = (rgb_image_copy * 255).astype(np.uint8)
-    gray_image = cv2.cvtColor(rgb_image_copy, cv2.COLOR_BGR2GRAY) 
+    gray_image = cv2.cvtColor(rgb_image, cv2.COLOR_BGR2GRAY) 
     overlay_image = rgb_image.copy()
-    if overlay_image.dtype != np.uint8:
-        overlay_image = (overlay_image * 255).astype(np.uint8)
    
     # generating an overlay on top of an image
-    for region_data in mask_list:
-        mask_data = region_data["mask"]
-        image_size = max(rgb_image.shape[:2])  # getting the larger dimension (height or width)
-        scaling_factor = image_size / 1000  # adjusting the divisor to control scaling
-        thickness = max(1, int(5 * scaling_factor))  # ensuring a minimum thickness of 1
-        boundaries = find_boundaries(mask_data, mode='outer')  
-        thick_boundaries = dilation(boundaries, disk(thickness))  
-        overlay_image[thick_boundaries.astype(bool)] = [255, 255, 255]  
-
-    if valid_props: 
+    image_size = max(rgb_image.shape[:2])  # getting the larger dimension (height or width)
+    scaling_factor = image_size / 1000  # adjusting the divisor to control scaling
+    thickness = max(1, int(5 * scaling_factor))  # ensuring a minimum thickness of 1
+
+    # outer boundaries of all cells at once: background or neighbouring-cell pixels next to a cell with a different label
+    # (labels are compared as float32, which is exact for any realistic number of cells)
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    labels = filtered_mask.astype(np.float32)
+    no_label = np.float32(filtered_mask.max() + 1)
+    neighbour_max = cv2.dilate(labels, cross)
+    neighbour_min = cv2.erode(np.where(filtered_mask > 0, labels, no_label), cross)
+    boundaries = ((neighbour_max != labels) & (neighbour_max > 0)) | ((neighbour_min != labels) & (neighbour_min < no_label))
+    thick_boundaries = cv2.dilate(boundaries.astype(np.uint8), disk(thickness).astype(np.uint8))
+    cv2.bitwise_or(overlay_image, (255, 255, 255, 0), dst=overlay_image, mask=thick_boundaries)  # painting the boundary pixels white in place
+
+    if mask_list: 
+        # moving the centroid coordinates to the end of the table as two named float columns
+        valid_props['centroid_y'] = valid_props.pop('centroid-0')
+        valid_props['centroid_x'] = valid_props.pop('centroid-1')
         temp_df = pd.DataFrame(valid_props)
         # overriding skimage-given labels to have them start at 1
         temp_df['label'] = list(range(1, len(temp_df) + 1))
-        # cleaning up centroid into two float columns
-        temp_df[['centroid_y', 'centroid_x']] = pd.DataFrame(temp_df['centroid'].tolist(), index=temp_df.index)
-        temp_df.drop(columns='centroid', inplace=True)
         temp_df['image_name'] = main_marker_image_name
         temp_df = temp_df[['image_name'] + [col for col in temp_df.columns if col != 'image_name']]
         temp_df['Condition']=condition_name
@@ -248,29 +305,49 @@ def analyze_segmented_cells(predicted_masks,
         return temp_df, overlay_image, gray_image, mask_list
 
 
+def expand_mask(mask_data):
+    """
+    Rebuild the full-image binary mask of an object stored as a bounding-box crop
+    (dictionaries with "mask", "bbox" and "shape"); full-size masks are returned unchanged
+    """
+    mask = mask_data["mask"]
+    if mask_data.get("bbox") is None:
+        return mask
+    min_row, min_col, max_row, max_col = mask_data["bbox"]
+    full_mask = np.zeros(mask_data["shape"], dtype=bool)
+    full_mask[min_row:max_row, min_col:max_col] = mask
+    return full_mask
+
+
 def convert_to_pixmap(array, format):
     """
     Convert a numpy array to QPixmap to display in GUI
     """
+    if array.dtype != np.uint8:
+        raise ValueError("Only 8-bit arrays can be converted to QPixmap.")
+    array = np.ascontiguousarray(array)  # QImage reads the raw buffer row by row
     height, width = array.shape[:2]
     if array.ndim == 2:  # grayscale image
         channels = 1
+    elif array.ndim == 3 and array.shape[2] == 3:  # RGB image
+        channels = 3
     elif array.ndim == 3 and array.shape[2] == 4:  # RGBA image
         channels = 4
     else:
         raise ValueError("Unsupported array shape for conversion to QPixmap.")
     bytes_per_line = width * channels
     q_image = QImage(array.data, width, height, bytes_per_line, format)
-    return QPixmap.fromImage(q_image)
+    return QPixmap.fromImage(q_image)  # the pixmap gets its own copy of the pixels, so the array can be freed afterwards
 
 
 def normalize_to_uint8(array):
     """
     Normalize a float or integer array to 8-bit (0–255) for image display.
     """
-    array = array - array.min()
-    array = (array / array.max() * 255).astype(np.uint8)
-    return array
+    if array.dtype == np.uint8 and array.min() == 0 and array.max() == 255:  # already spanning the full 8-bit range
+        return array
+    # min-max scaling and conversion to uint8 in a single pass
+    return cv2.normalize(array, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
 
 
 def compute_region_properties(binary_mask, intensity_image=None):
@@ -286,46 +363,48 @@ def compute_region_properties(binary_mask, intensity_image=None):
     - pd.DataFrame: Single-row DataFrame with aggregate measurements.
     """
     labeled_mask = measure.label(binary_mask.astype(np.uint8))
-    props = measure.regionprops(labeled_mask, intensity_image=intensity_image)
+    properties = ['area', 'bbox', 'area_convex', 'perimeter', 'eccentricity', 'extent', 'major_axis_length', 'minor_axis_length',
+                  'equivalent_diameter_area', 'feret_diameter_max', 'orientation', 'perimeter_crofton', 'solidity', 'centroid']
+    if intensity_image is not None:
+        properties += ['mean_intensity', 'max_intensity', 'min_intensity']
+    # One array per property over all objects, so the aggregates below are plain NumPy reductions
+    props = measure.regionprops_table(labeled_mask, intensity_image=intensity_image, properties=properties)
 
-    if not props:
+    areas = props['area']
+    if len(areas) == 0:
         return pd.DataFrame()
 
     # Total area of all objects combined
-    total_area = sum(p.area for p in props)
+    total_area = areas.sum()
     if total_area == 0:
         return pd.DataFrame()
 
-    # Helper: weighted average for scalar attrs
-    weighted_scalar = lambda attr: sum(p.area * getattr(p, attr) for p in props) / total_area
-
-    # Helper: weighted average for (y, x) centroid
-    centroid_y = sum(p.area * p.centroid[0] for p in props) / total_area
-    centroid_x = sum(p.area * p.centroid[1] for p in props) / total_area
+    # Helper: area-weighted average for scalar attrs
+    weighted_scalar = lambda attr: np.sum(areas * props[attr]) / total_area
 
     result = {
         'label': 1,
         'area': total_area,
-        'bbox_area': sum((p.bbox[2] - p.bbox[0]) * (p.bbox[3] - p.bbox[1]) for p in props),
-        'area_convex': sum(p.convex_area for p in props),
-        'perimeter': sum(p.perimeter for p in props),
+        'bbox_area': np.sum((props['bbox-2'] - props['bbox-0']) * (props['bbox-3'] - props['bbox-1'])),
+        'area_convex': props['area_convex'].sum(),
+        'perimeter': props['perimeter'].sum(),
         'eccentricity': weighted_scalar('eccentricity'),
         'extent': weighted_scalar('extent'),
         'major_axis_length': weighted_scalar('major_axis_length'),
         'minor_axis_length': weighted_scalar('minor_axis_length'),
-        'equivalent_diameter_area': weighted_scalar('equivalent_diameter'),
-        'feret_diameter_max': max(p.feret_diameter_max for p in props),
+        'equivalent_diameter_area': weighted_scalar('equivalent_diameter_area'),
+        'feret_diameter_max': props['feret_diameter_max'].max(),
         'orientation': weighted_scalar('orientation'),
-        'perimeter_crofton': sum(p.perimeter_crofton for p in props),
+        'perimeter_crofton': props['perimeter_crofton'].sum(),
         'solidity': weighted_scalar('solidity'),
-        'centroid_y': centroid_y,
-        'centroid_x': centroid_x,
+        'centroid_y': weighted_scalar('centroid-0'),
+        'centroid_x': weighted_scalar('centroid-1'),
     }
     # Add intensity-related features if an intensity image is provided
     if intensity_image is not None:
-        result['mean_intensity'] = np.mean([p.mean_intensity for p in props])
-        result['max_intensity'] = max(p.max_intensity for p in props)
-        result['min_intensity'] = min(p.min_intensity for p in props)
+        result['mean_intensity'] = np.mean(props['mean_intensity'])
+        result['max_intensity'] = props['max_intensity'].max()
+        result['min_intensity'] = props['min_intensity'].min()
         
     # Convert the result dictionary to a single-row DataFrame
     return pd.DataFrame([result])
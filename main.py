@@ -10,10 +10,14 @@ import zipfile
 import cv2
 import shutil
 import platform
+import tifffile
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 from skimage import measure
 from cellpose import models
-from PIL import Image
 
 from PyQt6.QtWidgets import QApplication, QLabel, QPushButton, QTextEdit, QLineEdit
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QMainWindow
@@ -22,7 +26,7 @@ from PyQt6.QtWidgets import QTabWidget, QScrollArea, QSizePolicy, QStyleFactory,
 from PyQt6.QtGui import QPixmap, QImage, QFont, QIcon, QPalette, QColor, QPainter
 from PyQt6.QtCore import Qt, pyqtSignal, QThread, QTimer,QSize, qInstallMessageHandler, QEvent
 
-from image_analysis_pipeline import open_folder, image_preprocessing, analyze_segmented_cells, convert_to_pixmap, normalize_to_uint8, pixel_conversion, compute_region_properties
+from image_analysis_pipeline import open_folder, image_preprocessing, analyze_segmented_cells, convert_to_pixmap, normalize_to_uint8, pixel_conversion, compute_region_properties, expand_mask
 from toggle import ImageViewer, ViewerModeController
 from input_form_components import InputFormWidget, DraggableTextEdit
 
@@ -295,6 +299,7 @@ class ImageProcessingApp(QMainWindow):
                     viewer.mask_id_to_group.clear()
                 if hasattr(viewer, "new_mask_dict"):
                     viewer.new_mask_dict.clear()
+                self.viewer_mode_controller.unregister_viewer(viewer)
             self.gray_viewers.clear()  # Remove old viewers
         # Load model from UI
         try:
@@ -667,7 +672,7 @@ class ImageProcessingApp(QMainWindow):
         """
         for viewer in self.gray_viewers:
             if mask_key in viewer.new_mask_dict:
-                return viewer.new_mask_dict[mask_key]["mask"]
+                return expand_mask(viewer.new_mask_dict[mask_key])
 
         for viewer in self.gray_viewers:
             if mask_key in viewer.callback_dict:
@@ -808,7 +813,9 @@ class ImageProcessingApp(QMainWindow):
                 # Create merged mask
                 merged_mask = np.zeros(self.worker.image_shape, dtype=np.uint8)
                 for item in group_items:
-                    merged_mask[item.binary_mask > 0] = 1
+                    min_row, min_col, max_row, max_col = item.bbox
+                    region = merged_mask[min_row:max_row, min_col:max_col]
+                    np.logical_or(region, item.binary_mask, out=region)
 
                 # Store new merged mask
                 viewer.new_mask_dict[merged_key] = {
@@ -858,7 +865,7 @@ class ImageProcessingApp(QMainWindow):
                 if cb_key not in active_keys or cb_key in existing_keys:
                     continue
 
-                mask = entry["mask"]
+                mask = expand_mask(entry)
                 self.worker.masks_dict[key] = {"mask": mask}
 
                 intensity_image = self.worker.image_dict.get(image_name)
@@ -912,8 +919,8 @@ class ImageProcessingApp(QMainWindow):
                 if region_mask.shape != intensity_image.shape:
                     region_mask = cv2.resize(region_mask, (intensity_image.shape[1], intensity_image.shape[0]), interpolation=cv2.INTER_NEAREST)
 
-                labeled_mask = measure.label(region_mask)
-                df_drawn_props = compute_region_properties(labeled_mask, intensity_image=intensity_image)
+                # compute_region_properties labels the mask itself
+                df_drawn_props = compute_region_properties(region_mask, intensity_image=intensity_image)
                 df_drawn_props['image_name'] = image_name
                 df_drawn_props['label'] = f"drawn_{prop.label}"
                 df_drawn_props['Replicate'] = self.input_form.rep_num.text()
@@ -1085,7 +1092,7 @@ class ImageProcessingApp(QMainWindow):
         Ensures no stale or unmerged masks are included.
         """
         grouped = []
-        for group in viewer.connected_groups:
+        for group in viewer.connected_groups.values():
             group_copy = {
                 "mask_ids": set(group["mask_ids"]),
                 "color": group["color"],
@@ -1110,6 +1117,7 @@ class ImageProcessingApp(QMainWindow):
                     viewer.mask_id_to_group.clear()
                 if hasattr(viewer, "new_mask_dict"):
                     viewer.new_mask_dict.clear()
+                self.viewer_mode_controller.unregister_viewer(viewer)
             self.gray_viewers.clear()
 
         # Clear image layout in GUI
@@ -1437,6 +1445,11 @@ class ImageProcessingWorker(QThread):
         self.nucleus_channel_present = nucleus_channel_present
         self.image_dict = {} # Stores preprocessed main marker images
         self.masks_dict = {} # Stores predicted masks keyed by image+label
+        self.prefetch_depth = 2 # Images prepared ahead of the segmentation model; more only holds extra image sets in memory
+        # Threads used for image loading and cell measurements: the prefetched images plus the one being measured.
+        # Kept small because Cellpose already uses every core when it runs on the CPU
+        self.max_workers = min(self.prefetch_depth + 1, os.cpu_count() or 1)
+        self.last_progress = -1 # Last progress value sent to the UI
 
     def stop(self):
         """
@@ -1444,6 +1457,94 @@ class ImageProcessingWorker(QThread):
         """
         self.active = False
         
+    def update_progress(self, num_done, num_images):
+        """
+        Send the progress to the UI only when the integer percentage changes,
+        so large folders do not flood the event queue with repaints.
+        """
+        progress = int((num_done / num_images) * 100)
+        if progress != self.last_progress:
+            self.progress_updated.emit(progress)
+            self.last_progress = progress
+
+    def preprocess_image(self, main_marker_image_path, nucleus_image_path):
+        """
+        Load and preprocess one image set (runs in the worker's thread pool).
+        Always returns (main_marker_image, nucleus_image, diameter, marker_channel, rgb), 
+        with nucleus_image set to None when no nucleus channel is used, or None for empty images.
+        """
+        result = image_preprocessing(main_marker_image_path, nucleus_image_path=nucleus_image_path if self.nucleus_channel_present else None,
+                                    main_marker_channel = self.color,
+                                    main_marker_contrast_high = self.main_marker_contrast_high,main_marker_contrast_low = self.main_marker_contrast_low,
+                                    nucleus_contrast_low = self.nucleus_contrast_low, nucleus_contrast_high = self.nucleus_contrast_high, # image of the channel that will be used for segmentation purposes (red/actin channel used here)
+                                    min_non_black_pixels_percentage = self.min_non_black_pixels_percentage,
+                                    intensity_threshold=self.intensity_threshold,  pixel_conv_rate=self.pixel_conv_rate,
+                                    diam = self.diam,
+                                    nucleus_channel_present=self.nucleus_channel_present)
+        if result is None:
+            return None
+        if self.nucleus_channel_present:
+            return result
+        main_marker_image, diamet, marker_channel_color, rgb = result
+        return main_marker_image, None, diamet, marker_channel_color, rgb
+
+    def analyze_image(self, main_marker_image_name, predicted_masks, main_marker_image, nucleus_image, rgb):
+        """
+        Measure the segmented cells of one image (runs in the worker's thread pool).
+        """
+        return analyze_segmented_cells(predicted_masks, main_marker_image, main_marker_image_name, 
+                                        pixel_conv_rate=self.pixel_conv_rate,
+                                        rgb_image = rgb, min_area = self.min_area,
+                                        condition_name= self.condition_name, replicate_num = self.rep_num,
+                                        nucleus_image=nucleus_image if self.nucleus_channel_present else None,
+                                        min_nucleus_pixels_percentage=self.min_nucleus_pixels_percentage if self.nucleus_channel_present else None,
+                                        nucleus_pixel_threshold=self.nucleus_pixel_threshold if self.nucleus_channel_present else None,
+                                        nucleus_channel_present=self.nucleus_channel_present)
+
+    def emit_processed_image(self, main_marker_image_name, analysis_future, preprocessed):
+        """
+        Collect the analysis results of one image, store them and send the images to the UI.
+        Only called from the worker thread, so all_props_df and masks_dict are never shared between threads.
+        """
+        if analysis_future is None:  # Image was skipped or failed before segmentation
+            return
+        try:
+            main_marker_image, _, _, _, rgb = preprocessed
+            df, overlay_image, gray_image, masks_list = analysis_future.result()
+            self.image_dict[main_marker_image_name] = main_marker_image.copy()
+
+            # Store masks in a dictionary
+            for mask, label in zip(masks_list, df['label']):
+                mask_key = f"{main_marker_image_name}{label}"
+                self.masks_dict[mask_key] = mask
+
+            # === Normalize images and emit UI updates ===
+            if df is not None and self.active:
+                self.all_props_df = pd.concat([self.all_props_df, df], ignore_index=True)
+                # Normalizing images to uint8
+                gray_image = normalize_to_uint8(gray_image)
+                rgb = normalize_to_uint8(rgb)  # Only normalizing if it's not in the range 0–255 already
+                overlay_image = normalize_to_uint8(overlay_image)
+
+                # Converting processed images to QPixmap
+                pixmap_gray = convert_to_pixmap(gray_image, QImage.Format.Format_Grayscale8)
+                pixmap_rgb = convert_to_pixmap(rgb, QImage.Format.Format_RGB888)
+                pixmap_overlay = convert_to_pixmap(overlay_image, QImage.Format.Format_RGB888)
+                # Emitting signal to update the UI with the processed images
+
+                if len(df)==1:
+                    display_name = f"{main_marker_image_name}: 1 cell processed"
+                else:
+                    display_name = f"{main_marker_image_name}: {len(df)} cells processed"
+
+                self.image_processed.emit(display_name, pixmap_gray, pixmap_rgb, pixmap_overlay, masks_list)
+
+                self.count += 1
+
+        except Exception as e:
+            #print(e)
+            return  # Moving to the next image
+
     def run(self):
         """
         Main execution logic for the thread.
@@ -1503,111 +1604,91 @@ class ImageProcessingWorker(QThread):
         # === Begin processing ===
         self.status_update.emit("Processing started...")
         self.all_props_df = pd.DataFrame()
-        num_images = len(self.images)  # Getting total number of images
         self.masks_dict = {}  # Dictionary to store masks
 
-        fail = True # Indicates whether any images were processed
-        for num, (name, image) in enumerate(self.images.items()):
-            if not self.active:
-                break
-
-            if self.main_marker_identifier in name and self.main_marker_identifier!="" and self.active:
-                main_marker_image_name = name
-                main_marker_image_path = image
-                # Load image shape for future use
-                if not hasattr(self, "image_shape"):
-                    image_array = np.array (Image.open(main_marker_image_path))
-                    self.image_shape = image_array.shape
+        # Collecting the (name, segmentation image path, nucleus image path) sets to process
+        tasks = []
+        for name, image in self.images.items():
+            if self.main_marker_identifier in name and self.main_marker_identifier != "":
+                nucleus_image_path = None
                 # === Handle nucleus channel ===
                 if self.nucleus_channel_present:
                     nucleus_name = name.replace(self.main_marker_identifier, self.nucleus_identifier)
-                    if (nucleus_name not in self.images or self.nucleus_identifier=="") and (self.active):  # Prevent KeyError
+                    if nucleus_name not in self.images or self.nucleus_identifier == "":  # Prevent KeyError
                         self.status_update.emit(f"Missing nucleus image: {nucleus_name}")
                         self.finished_processing.emit()
                         return
                     nucleus_image_path = self.images[nucleus_name]
- 
-                if self.active:
-                    try:
-                        # === Preprocessing ===
-                        if not self.active:
-                            break
-                        if self.nucleus_channel_present:
-                            main_marker_image, nucleus_image, diamet, marker_channel_color, rgb = image_preprocessing(main_marker_image_path, nucleus_image_path=nucleus_image_path if self.nucleus_channel_present else None,
-                                                                                                        main_marker_channel = self.color,
-                                                                                                        main_marker_contrast_high = self.main_marker_contrast_high,main_marker_contrast_low = self.main_marker_contrast_low,
-                                                                                                        nucleus_contrast_low = self.nucleus_contrast_low, nucleus_contrast_high = self.nucleus_contrast_high, # image of the channel that will be used for segmentation purposes (red/actin channel used here)
-                                                                                                        min_non_black_pixels_percentage = self.min_non_black_pixels_percentage,
-                                                                                                        intensity_threshold=self.intensity_threshold,  pixel_conv_rate=self.pixel_conv_rate,
-                                                                                                        diam = self.diam,
-                                                                                                        nucleus_channel_present=self.nucleus_channel_present)
-                        else:
-                            main_marker_image, diamet, marker_channel_color, rgb = image_preprocessing(main_marker_image_path, nucleus_image_path=nucleus_image_path if self.nucleus_channel_present else None,
-                                                                                                        main_marker_channel = self.color,
-                                                                                                        main_marker_contrast_high = self.main_marker_contrast_high,main_marker_contrast_low = self.main_marker_contrast_low,
-                                                                                                        nucleus_contrast_low = self.nucleus_contrast_low, nucleus_contrast_high = self.nucleus_contrast_high, # image of the channel that will be used for segmentation purposes (red/actin channel used here)
-                                                                                                        min_non_black_pixels_percentage = self.min_non_black_pixels_percentage,
-                                                                                                        intensity_threshold=self.intensity_threshold,  pixel_conv_rate=self.pixel_conv_rate,
-                                                                                                        diam = self.diam,
-                                                                                                        nucleus_channel_present=self.nucleus_channel_present)
-                        if not self.active:
-                            break
-                        self.image_dict[main_marker_image_name] = main_marker_image.copy()
+                tasks.append((name, image, nucleus_image_path))
 
-                        # === Run segmentation model ===
-                        predicted_masks, _, _ = self.model.eval(main_marker_image, diameter=diamet, flow_threshold = self.thresh,  channels=[0, marker_channel_color])
+        if not tasks:
+            self.status_update.emit("No images found in the folder. Check file IDs")
+            self.finished_processing.emit() 
+            return
+
+        # Load image shape for future use (read from the file header, without decoding the pixels)
+        if not hasattr(self, "image_shape"):
+            with tifffile.TiffFile(tasks[0][1]) as tif:
+                self.image_shape = tif.pages[0].shape
+
+        fail = True # Indicates whether any images were processed
+        num_images = len(tasks)  # Getting total number of images
+        num_done = 0
+        window = min(self.prefetch_depth, self.max_workers)  # Number of images prepared ahead of the segmentation model
+        task_iter = iter(tasks)
+        preprocess_queue = deque()  # (name, future) pairs waiting for segmentation, in folder order
+        analysis_queue = deque()  # (name, future, preprocessed) sets waiting to be emitted, in folder order
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # Preprocessing the first few images in the background
+            for name, main_marker_image_path, nucleus_image_path in islice(task_iter, window):
+                preprocess_queue.append((name, pool.submit(self.preprocess_image, main_marker_image_path, nucleus_image_path)))
+
+            while preprocess_queue and self.active:
+                name, preprocess_future = preprocess_queue.popleft()
+                # Keeping the prefetch window full while the model runs on the current image
+                next_task = next(task_iter, None)
+                if next_task is not None:
+                    preprocess_queue.append((next_task[0], pool.submit(self.preprocess_image, *next_task[1:])))
+
+                preprocessed = None
+                analysis_future = None
+                try:
+                    # === Preprocessing ===
+                    preprocessed = preprocess_future.result()
+                    if preprocessed is not None and self.active:  # Skipping empty images
+                        main_marker_image, nucleus_image, diamet, marker_channel_color, rgb = preprocessed
 
-                        if not self.active:
-                            break
+                        # === Run segmentation model ===
+                        # Only this thread calls the model, so GPU inference stays serialized
+                        with torch.inference_mode():  # No autograd bookkeeping is needed for prediction
+                            predicted_masks, _, _ = self.model.eval(main_marker_image, diameter=diamet, flow_threshold = self.thresh,  channels=[0, marker_channel_color])
 
                         # === Analyze segmented cells ===
-                        df, overlay_image, gray_image, masks_list = analyze_segmented_cells(predicted_masks, main_marker_image, main_marker_image_name, 
-                                                                                        pixel_conv_rate=self.pixel_conv_rate,
-                                                                                        rgb_image = rgb, min_area = self.min_area,
-                                                                                        condition_name= self.condition_name, replicate_num = self.rep_num,
-                                                                                        nucleus_image=nucleus_image if self.nucleus_channel_present else None,
-                                                                                        min_nucleus_pixels_percentage=self.min_nucleus_pixels_percentage if self.nucleus_channel_present else None,
-                                                                                        nucleus_pixel_threshold=self.nucleus_pixel_threshold if self.nucleus_channel_present else None,
-                                                                                        nucleus_channel_present=self.nucleus_channel_present)
-                        if not self.active:
-                            break
-                        # Store masks in a dictionary
-                        for mask, label in zip(masks_list, df['label']):
-                            mask_key = f"{main_marker_image_name}{label}"
-                            self.masks_dict[mask_key] = mask
-
-                        # === Normalize images and emit UI updates ===
-                        if df is not None and self.active:
-                            self.all_props_df = pd.concat([self.all_props_df, df], ignore_index=True)
-                            # Normalizing images to uint8
-                            if not self.active:
-                                break
-                            gray_image = normalize_to_uint8(gray_image)
-                            rgb = normalize_to_uint8(rgb)  # Only normalizing if it's not in the range 0–255 already
-                            overlay_image = normalize_to_uint8(overlay_image)
-
-                            if not self.active:
-                                break
-                            # Converting processed images to QPixmap
-                            pixmap_gray = convert_to_pixmap(gray_image, QImage.Format.Format_Grayscale8)
-                            pixmap_rgb = convert_to_pixmap(np.concatenate([rgb, np.full((rgb.shape[0], rgb.shape[1], 1), 255, dtype=np.uint8)], axis=-1), QImage.Format.Format_RGBA8888)
-                            pixmap_overlay = convert_to_pixmap(np.concatenate([overlay_image, np.full((overlay_image.shape[0], overlay_image.shape[1], 1), 255, dtype=np.uint8)], axis=-1), QImage.Format.Format_RGBA8888)
-                            # Emitting signal to update the UI with the processed images
-
-                            if len(df)==1:
-                                display_name = f"{main_marker_image_name}: 1 cell processed"
-                            else:
-                                display_name = f"{main_marker_image_name}: {len(df)} cells processed"
-
-                            self.image_processed.emit(display_name, pixmap_gray, pixmap_rgb, pixmap_overlay, masks_list)
-
-                            self.count += 1
-
-                    except Exception as e:
-                        #print(e)
-                        continue  # Moving to the next image
-             # === Update progress ===
-            self.progress_updated.emit(int(((num + 1) / num_images) * 100))
+                        analysis_future = pool.submit(self.analyze_image, name, predicted_masks, main_marker_image, nucleus_image, rgb)
+                except Exception as e:
+                    #print(e)
+                    pass  # Moving to the next image
+                analysis_queue.append((name, analysis_future, preprocessed))
+
+                # === Emit finished images in order ===
+                while analysis_queue and self.active and (analysis_queue[0][1] is None or analysis_queue[0][1].done() or len(analysis_queue) > window):
+                    self.emit_processed_image(*analysis_queue.popleft())
+                    num_done += 1
+                    # === Update progress ===
+                    self.update_progress(num_done, num_images)
+
+            while analysis_queue and self.active:
+                self.emit_processed_image(*analysis_queue.popleft())
+                num_done += 1
+                self.update_progress(num_done, num_images)
+
+            if not self.active:
+                pool.shutdown(wait=True, cancel_futures=True)  # Dropping images that have not started yet
+
+        # Releasing the GPU memory cached during segmentation once all images are done
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
         
         # === Post-processing ===
         if (fail and self.active and self.count >= 1) or (not self.active):
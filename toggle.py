@@ -1,9 +1,9 @@
 
 import numpy as np
 
-from PyQt6.QtCore import Qt, QEvent
-from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsTextItem, QGraphicsPathItem
-from PyQt6.QtGui import QPixmap, QImage, QColor, QFont, QPen, QPainter, QPainterPath
+from PyQt6.QtCore import Qt, QEvent, QSize, QRectF, QPointF
+from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsItem, QGraphicsPixmapItem, QGraphicsTextItem, QGraphicsPathItem
+from PyQt6.QtGui import QPixmap, QImage, QColor, QFont, QPen, QPainter, QPainterPath, QTransform
 
 
 class ViewerModeController:
@@ -24,6 +24,14 @@ class ViewerModeController:
         viewer.set_mode(self._mode)  # Set the current shared mode to the new viewer
         viewer.mode_check_enabled = True # Enable mode-dependent behavior in the viewer
 
+    def unregister_viewer(self, viewer):
+        """
+        Stop syncing a viewer that is being discarded, so old viewers
+        do not pile up across processing runs.
+        """
+        if viewer in self.viewers:
+            self.viewers.remove(viewer)
+
     def set_mode(self, new_mode):
         """
         Change the mode and propagate it to all registered viewers.
@@ -32,6 +40,10 @@ class ViewerModeController:
         # Normalize input: if empty string, treat as None
         if new_mode == "":
             new_mode = None
+
+        # Registered viewers always follow the controller, so there is nothing to propagate
+        if new_mode == self._mode:
+            return
         
         self._mode = new_mode
         for viewer in self.viewers:
@@ -56,7 +68,7 @@ class ClickableMask(QGraphicsPixmapItem):
     Custom QGraphicsPixmapItem subclass for handling individual mask interactivity.
     Supports opacity toggling, tracking active/inactive state, and integration with viewer callbacks.
     """
-    def __init__(self, pixmap, name, label, click_callback, binary_mask, connection_mode_getter, viewer):
+    def __init__(self, pixmap, name, label, click_callback, binary_mask, connection_mode_getter, viewer, bbox=None, image_shape=None):
         """
         Initialize the ClickableMask item.
 
@@ -65,9 +77,11 @@ class ClickableMask(QGraphicsPixmapItem):
         - name: Name of the image this mask belongs to.
         - label: Unique label for the mask within the image.
         - click_callback: Function to call when the mask is toggled.
-        - binary_mask: Binary array representation of the mask.
+        - binary_mask: Binary array representation of the mask (cropped to its bounding box).
         - connection_mode_getter: Callable that returns whether connection mode is active.
         - viewer: The parent viewer object managing this mask.
+        - bbox: (min_row, min_col, max_row, max_col) of the mask in the full image; defaults to the whole mask.
+        - image_shape: Shape of the full image; defaults to the mask shape.
         """
         super().__init__(pixmap)
         self.setAcceptHoverEvents(True) # Enable hover events if needed later
@@ -78,8 +92,11 @@ class ClickableMask(QGraphicsPixmapItem):
 
         self.label = label           # Label associated with this mask
         self.name = name             # Name (usually image or group identifier)
+        self.mask_id = viewer.get_mask_id(name, label) # Cached "<name>_<label>" ID
         self.is_inactive = False     # Track if mask is dimmed (inactive)
         self.binary_mask = binary_mask
+        self.bbox = bbox if bbox is not None else (0, 0, *binary_mask.shape)
+        self.image_shape = image_shape if image_shape is not None else binary_mask.shape
         self.connection_mode_getter = connection_mode_getter # Check if in "connect" mode
         self.click_callback = click_callback # Callback function for clicks
         self.viewer = viewer # Reference to the viewer managing masks
@@ -108,8 +125,7 @@ class ClickableMask(QGraphicsPixmapItem):
         """
         Toggle mask or group of masks depending on whether this mask is part of a group.
         """
-        mask_id = self.viewer.get_mask_id(self.name, self.label)
-        group = self.viewer.mask_id_to_group.get(mask_id)
+        group = self.viewer.mask_id_to_group.get(self.mask_id)
         # If grouped with other masks, toggle them together
         if group:
             self.toggle_group(group)
@@ -121,10 +137,12 @@ class ClickableMask(QGraphicsPixmapItem):
         Toggle visibility for a group of masks.
         """
         # Determine current state from any one mask (they should be synchronized)
-        turning_off = self.opacity() == self.viewer.active_opacity
+        turning_off = not self.is_inactive
 
-        # Create a key for the merged/grouped entry
-        merged_key = self.viewer.generate_merged_key(self.name, group["mask_ids"])
+        # Create a key for the merged/grouped entry (a group's mask IDs never change, so keep it on the group)
+        merged_key = group.get("toggle_key")
+        if merged_key is None:
+            merged_key = group["toggle_key"] = self.viewer.generate_merged_key(self.name, group["mask_ids"])
 
         # Update merged entry in callback dict
         self.viewer.callback_dict[merged_key] = {
@@ -133,13 +151,15 @@ class ClickableMask(QGraphicsPixmapItem):
             "is_active": not turning_off,
             "merged": True
         }
-        # Update each mask in the group
+        # Update each mask in the group, leaving masks already in the target state untouched
+        new_opacity = self.viewer.inactive_opacity if turning_off else self.viewer.active_opacity
         for mid in group["mask_ids"]:
             item = self.viewer.get_item_by_id(mid)
             if item:
-                item.setOpacity(self.viewer.inactive_opacity if turning_off else self.viewer.active_opacity)
-                item.is_inactive = turning_off
-                individual_key = f"{item.name}_{item.label}"
+                if item.is_inactive != turning_off:
+                    item.setOpacity(new_opacity)
+                    item.is_inactive = turning_off
+                individual_key = item.mask_id
                 if individual_key in self.viewer.callback_dict:
                     self.viewer.callback_dict[individual_key]["is_active"] = not turning_off
 
@@ -151,19 +171,39 @@ class ClickableMask(QGraphicsPixmapItem):
         """
         Toggle visibility of a single mask and notify viewer of the change.
         """
-        turning_off = self.opacity() == self.viewer.active_opacity
+        turning_off = not self.is_inactive
         self.setOpacity(self.viewer.inactive_opacity if turning_off else self.viewer.active_opacity)
         self.is_inactive = turning_off
         # Notify the viewer that this individual mask was toggled
         self.viewer.mask_click_callback(self.name, self.label, not turning_off)
 
 
+class DrawingCanvasItem(QGraphicsItem):
+    """
+    Scene item that paints the viewer's drawing canvas in place.
+    Unlike QGraphicsPixmapItem it keeps no copy of the pixmap, so strokes can be
+    painted straight onto the canvas and only the touched region repainted.
+    """
+    def __init__(self, canvas):
+        super().__init__()
+        self.canvas = canvas
+
+    def boundingRect(self):
+        return QRectF(self.canvas.rect())
+
+    def paint(self, painter, option, widget=None):
+        painter.drawPixmap(QPointF(0, 0), self.canvas)
+
+
 class ImageViewer(QGraphicsView):
     """
     Main class for displaying images and associated interactive masks.
     Supports toggling masks, connecting/disconnecting them, drawing overlays,
     and syncing with other viewers via ViewerModeController.
     """
+
+    hue_table = None # RGBA color for each whole hue, shared by all viewers
+
     def __init__(self, pixmap, masks, font_size, show_labels=False, colors=None, image_name=None, mode_controller=None):
         """
         Initializes the ImageViewer widget.
@@ -182,6 +222,10 @@ class ImageViewer(QGraphicsView):
         # Callback information for individual masks
         self.callback_dict = {} # Collect callback functions for each mask
         self.original_masks = masks
+        self.original_mask_by_key = {} # (image_name, label) -> original mask entry
+        for mask_data in masks:
+            self.original_mask_by_key.setdefault((mask_data["image_name"], mask_data["label"]), mask_data)
+        self.recolored_pixmaps = {} # (image_name, label, rgba) -> recolored mask pixmap
         self.mode_controller = mode_controller  
         self.mode = "toggle"
 
@@ -196,7 +240,8 @@ class ImageViewer(QGraphicsView):
         self.disconnect_mode = self.mode == "connect"
         self.mouse_path = []
         self.connection_line = None
-        self.connected_groups = []  # list of mask group dicts
+        self.connection_path = None
+        self.connected_groups = {}  # id(group) -> mask group dict, in creation order
         self.mask_id_to_group = {}  # mask_id -> group dict
         self.disconnect_mode = False
         self.new_mask_dict = {}
@@ -208,8 +253,14 @@ class ImageViewer(QGraphicsView):
         self.image_name = image_name
         self.drawing_canvas = QPixmap(pixmap.size())
         self.drawing_canvas.fill(Qt.GlobalColor.transparent)
-        self.drawing_item = QGraphicsPixmapItem(self.drawing_canvas)
+        self.drawing_item = DrawingCanvasItem(self.drawing_canvas)
         self.drawing_item.setZValue(999)  # On top of masks
+        # Pens are built once rather than on every mouse move
+        self.connect_pen = QPen(QColor(255, 255, 255), 2)
+        self.draw_pen = QPen(QColor(255, 0, 0), 3, Qt.PenStyle.SolidLine)
+        # Transparent pen used with the Clear composition mode to erase pixels
+        eraser_size = 30
+        self.erase_pen = QPen(QColor(0, 0, 0, 0), eraser_size)
 
         # Display settings
         self.active_opacity = 1.0
@@ -225,6 +276,7 @@ class ImageViewer(QGraphicsView):
         self.graphics_scene.addItem(self.pixmap_item)
 
         self.mask_items = [] # For storing mask items added to the scene
+        self.items_by_id = {} # mask_id -> mask item, for constant-time lookups
 
         # Generating a unique color for each mask
         num_masks = len(masks)
@@ -300,6 +352,10 @@ class ImageViewer(QGraphicsView):
         self.setTransformationAnchor(QGraphicsView.ViewportAnchor.AnchorViewCenter)
         self.setDragMode(QGraphicsView.DragMode.NoDrag)
         self.setStyleSheet("border: none; padding: 0px; margin: 0px;")
+        # Toggling a group dirties many small mask rects; let Qt merge them into one repaint
+        self.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.SmartViewportUpdate)
+        # Nothing in the viewer is antialiased, so skip the extra pixel of exposed area
+        self.setOptimizationFlag(QGraphicsView.OptimizationFlag.DontAdjustForAntialiasing, True)
 
     def generate_merged_key(self, name, mask_ids):
         labels = sorted(str(self.get_item_by_id(mid).label) for mid in mask_ids)
@@ -342,26 +398,28 @@ class ImageViewer(QGraphicsView):
         if self.mode == "connect" and event.buttons() & Qt.MouseButton.LeftButton:
             # Convert the current mouse position to scene coordinates
             scene_point = self.mapToScene(event.position().toPoint())
+            if self.mouse_path and scene_point == self.mouse_path[-1]:
+                event.accept()
+                return # Fast mice report the same pixel repeatedly; nothing new to sample or draw
             self.mouse_path.append(scene_point)
 
-             # Remove the existing temporary path (if any)
-            if self.connection_line:
-                self.graphics_scene.removeItem(self.connection_line)
+            # Create the temporary path item on the first move of the stroke
+            if self.connection_line is None:
+                self.connection_path = QPainterPath()
+                self.connection_path.moveTo(self.mouse_path[0])
+                for pt in self.mouse_path[1:-1]:
+                    self.connection_path.lineTo(pt)
+
+                # Create a QGraphicsPathItem for the path
+                self.connection_line = QGraphicsPathItem(self.connection_path)
+                self.connection_line.setPen(self.connect_pen)
+                self.connection_line.setZValue(200)
+                # Add the path to the scene
+                self.graphics_scene.addItem(self.connection_line)
 
-            # Create a new path from recorded mouse points
-            path = QPainterPath()
-            path.moveTo(self.mouse_path[0])
-            for pt in self.mouse_path[1:]:
-                path.lineTo(pt)
-
-            # Set pen style and create a QGraphicsPathItem for the path
-            pen = QPen(QColor("white"))
-            pen.setWidth(2)
-            self.connection_line = QGraphicsPathItem(path)
-            self.connection_line.setPen(pen)
-            self.connection_line.setZValue(200)
-            # Add the path to the scene
-            self.graphics_scene.addItem(self.connection_line)
+            # Extend the path by the new segment only
+            self.connection_path.lineTo(scene_point)
+            self.connection_line.setPath(self.connection_path)
 
             event.accept()
 
@@ -373,13 +431,12 @@ class ImageViewer(QGraphicsView):
              # If we have a valid previous point, draw a red line from it
             if self.last_draw_point is not None:  
                 painter = QPainter(self.drawing_canvas)
-                pen = QPen(QColor("red"), 3, Qt.PenStyle.SolidLine)
-                painter.setPen(pen)
+                painter.setPen(self.draw_pen)
                 painter.drawLine(self.last_draw_point, current_point)
                 painter.end()
 
-                #  Update the QGraphicsPixmapItem to show the new drawing
-                self.drawing_item.setPixmap(self.drawing_canvas)
+                # Repaint only the area around the new segment
+                self.update_drawing_region(self.last_draw_point, current_point, self.draw_pen)
             # Update the last point to current for next segment
             self.last_draw_point = current_point  
             event.accept()
@@ -392,16 +449,12 @@ class ImageViewer(QGraphicsView):
                 painter = QPainter(self.drawing_canvas)
                  # Set composition mode to clear (erase) pixels
                 painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-
-                # Set a transparent pen to simulate erasing
-                eraser_size = 30
-                pen = QPen(QColor(0, 0, 0, 0), eraser_size)
-                painter.setPen(pen)
+                painter.setPen(self.erase_pen)
                 # Draw a line to erase from the last to current point
                 painter.drawLine(self.last_draw_point, current_point)
                 painter.end()
-                # Update the displayed pixmap
-                self.drawing_item.setPixmap(self.drawing_canvas)
+                # Update the displayed region
+                self.update_drawing_region(self.last_draw_point, current_point, self.erase_pen)
 
             self.last_draw_point = current_point
             event.accept()
@@ -421,6 +474,7 @@ class ImageViewer(QGraphicsView):
             if self.connection_line:
                 self.graphics_scene.removeItem(self.connection_line)
                 self.connection_line = None
+                self.connection_path = None
 
             event.accept()
 
@@ -434,17 +488,29 @@ class ImageViewer(QGraphicsView):
         else:
             super().mouseReleaseEvent(event)
 
+    def update_drawing_region(self, start, end, pen):
+        """Schedules a repaint of the drawing canvas around a stroke segment."""
+        margin = pen.widthF() / 2 + 1
+        rect = QRectF(start, end).normalized().adjusted(-margin, -margin, margin, margin)
+        self.drawing_item.update(rect)
+
     def extract_color_from_pixmap(self, pixmap):
         """Extracts the first non-transparent pixel's color from a pixmap."""
-        image = pixmap.toImage()
+        image = pixmap.toImage().convertToFormat(QImage.Format.Format_RGBA8888)
         width, height = image.width(), image.height()
-        
-        # Scan the image pixel by pixel
-        for y in range(height):
-            for x in range(width):
-                pixel = image.pixelColor(x, y)
-                if pixel.alpha() > 0: # Check if pixel is not fully transparent
-                    return (pixel.red(), pixel.green(), pixel.blue(), pixel.alpha())
+        if width == 0 or height == 0:
+            return (255, 255, 255, 255)
+
+        # View the pixel buffer as an array and scan the alpha channel in one pass
+        ptr = image.constBits()
+        ptr.setsize(image.sizeInBytes())
+        rows = np.frombuffer(ptr, dtype=np.uint8).reshape(height, image.bytesPerLine())
+        pixels = rows[:, :width * 4].reshape(height, width, 4)
+
+        visible = pixels[..., 3] > 0 # Check if pixel is not fully transparent
+        if visible.any():
+            y, x = np.unravel_index(np.argmax(visible), visible.shape)
+            return tuple(int(v) for v in pixels[y, x])
          # Return white if no visible pixel found
         return (255, 255, 255, 255) 
     
@@ -483,7 +549,7 @@ class ImageViewer(QGraphicsView):
          # Create a merged mask preview
         merged_mask = self.create_merged_mask(active_items)
          # Get unique IDs for the selected masks
-        mask_ids = {self.get_mask_id(m.name, m.label) for m in active_items}
+        mask_ids = {m.mask_id for m in active_items}
 
         # If all hit masks are part of the same group, disconnect them
         if self.check_and_disconnect(hit_masks):
@@ -496,30 +562,48 @@ class ImageViewer(QGraphicsView):
         Returns a set of masks touched by the mouse stroke path.
         """
         hit_masks = set()
+        # The displayed pixmap does not change during a stroke
+        pixmap = self.pixmap_item.pixmap()
+        pw, ph = pixmap.width(), pixmap.height()
+        pts = np.array([(pt.x(), pt.y()) for pt in self.mouse_path], dtype=np.float64).reshape(-1, 2)
+        if len(pts) == 0:
+            return hit_masks
+
+        # Stroke points in image coordinates and their bounding box, per image shape
+        stroke_by_shape = {}
         for item in self.mask_items:
             if item.is_inactive:
                 continue
-            for pt in self.mouse_path:
-                # Convert from scene to image coordinates
-                scene_x, scene_y = pt.x(), pt.y()
-                img_x = int(scene_x * item.binary_mask.shape[1] / self.pixmap_item.pixmap().width())
-                img_y = int(scene_y * item.binary_mask.shape[0] / self.pixmap_item.pixmap().height())
-                # Check if the point falls within the binary mask
-                if 0 <= img_x < item.binary_mask.shape[1] and 0 <= img_y < item.binary_mask.shape[0]:
-                    if item.binary_mask[img_y, img_x]:
-                        hit_masks.add(item)
-                        break  # Only need one hit point per mask
+            ih, iw = item.image_shape[:2]
+            if (ih, iw) not in stroke_by_shape:
+                # Convert from scene to image coordinates (truncating like int())
+                xs = (pts[:, 0] * iw / pw).astype(np.int64)
+                ys = (pts[:, 1] * ih / ph).astype(np.int64)
+                stroke_by_shape[(ih, iw)] = (xs, ys, xs.min(), xs.max(), ys.min(), ys.max())
+            img_x, img_y, x_lo, x_hi, y_lo, y_hi = stroke_by_shape[(ih, iw)]
+
+            # Skip masks whose bounding box the stroke cannot reach
+            min_row, min_col, max_row, max_col = item.bbox
+            if x_hi < min_col or x_lo >= max_col or y_hi < min_row or y_lo >= max_row:
+                continue
+
+            # Keep the points inside the mask's bounding box, then look them up in the binary mask
+            inside = (img_x >= min_col) & (img_x < max_col) & (img_y >= min_row) & (img_y < max_row)
+            if item.binary_mask[img_y[inside] - min_row, img_x[inside] - min_col].any():
+                hit_masks.add(item)
         return hit_masks
     
     def create_merged_mask(self, active_items):
         """
         Combines binary masks into one merged mask and generates metadata.
         """
-        merged_mask = np.zeros_like(active_items[0].binary_mask, dtype=np.int32)
+        merged_mask = np.zeros(active_items[0].image_shape, dtype=np.uint8)
         label_names = []
 
         for item in active_items:
-            merged_mask[item.binary_mask > 0] = 1
+            min_row, min_col, max_row, max_col = item.bbox
+            region = merged_mask[min_row:max_row, min_col:max_col]
+            np.logical_or(region, item.binary_mask, out=region)
             label_names.append(str(item.label))
 
         label_names = sorted(label_names)
@@ -547,14 +631,13 @@ class ImageViewer(QGraphicsView):
     def check_and_disconnect(self, hit_masks):
         """Check if all hit masks are part of the same group and disconnect them if so."""
         connected_mask_ids = {
-            self.get_mask_id(m.name, m.label)
-            for m in hit_masks if self.get_mask_id(m.name, m.label) in self.mask_id_to_group
+            m.mask_id for m in hit_masks if m.mask_id in self.mask_id_to_group
         }
 
         # All masks must belong to some group
         if len(connected_mask_ids) == len(hit_masks):
-            group_ids = [self.mask_id_to_group[mid] for mid in connected_mask_ids]
-            if len(set(map(id, group_ids))) == 1: # All in the same group
+            group_ids = {id(self.mask_id_to_group[mid]) for mid in connected_mask_ids}
+            if len(group_ids) == 1: # All in the same group
                 group = self.mask_id_to_group.get(next(iter(connected_mask_ids)))
                 if group:
                     self.disconnect_group(group)
@@ -564,25 +647,17 @@ class ImageViewer(QGraphicsView):
     def merge_and_connect_masks(self, active_items, mask_ids, merged_mask):
         """Merge selected masks into a group and recolor them with a unified color."""
         # Find and unify existing groups
-        groups = [self.mask_id_to_group[mid] for mid in mask_ids if mid in self.mask_id_to_group]
-        seen = set()
-        unique_groups = []
-        for group in groups:
-            group_id = id(group)
-            if group_id not in seen:
-                seen.add(group_id)
-                unique_groups.append(group)
-
-        # Merge all mask IDs and items
+        groups = (self.mask_id_to_group[mid] for mid in mask_ids if mid in self.mask_id_to_group)
+        unique_groups = list({id(group): group for group in groups}.values())
+
+        # Merge all mask IDs
         merged_mask_ids = set(mask_ids)
-        merged_items = list(active_items)
-        merged_color = merged_items[0].default_color
+        merged_color = active_items[0].default_color
 
          # Flatten the groups and remove them
         for group in unique_groups:
             merged_mask_ids.update(group["mask_ids"])
-            merged_items.extend(self.get_items_by_ids(group["mask_ids"]))
-            self.connected_groups.remove(group)
+            del self.connected_groups[id(group)]
 
         # Create and register a new group
         new_group = {
@@ -590,14 +665,14 @@ class ImageViewer(QGraphicsView):
             "color": merged_color,
             "mask": merged_mask
         }
-        self.connected_groups.append(new_group)
+        self.connected_groups[id(new_group)] = new_group
         for mid in merged_mask_ids:
             self.mask_id_to_group[mid] = new_group
 
         # Update callbacks and recolor masks
         for item in active_items:
             self.recolor_mask(item, merged_color)
-            key = f"{item.name}_{item.label}"
+            key = item.mask_id
 
             if key not in self.pre_merge_callback_state:
                 self.pre_merge_callback_state[key] = self.callback_dict.get(key, {}).copy()
@@ -614,14 +689,12 @@ class ImageViewer(QGraphicsView):
 
     def get_item_by_id(self, mask_id):
         """Return the mask item corresponding to the given mask ID."""
-        for item in self.mask_items:
-            if self.get_mask_id(item.name, item.label) == mask_id:
-                return item
-        return None
+        return self.items_by_id.get(mask_id)
     
     def get_items_by_ids(self, id_set):
-            """Return a list of mask items for a given set of mask IDs."""
-            return [self.get_item_by_id(mid) for mid in id_set]
+        """Return a list of mask items for a given set of mask IDs, skipping unknown IDs."""
+        items = (self.items_by_id.get(mid) for mid in id_set)
+        return [item for item in items if item is not None]
     
     def get_mask_id(self, name, label):
         """Generate a unique ID string for a mask from its name and label."""
@@ -653,7 +726,7 @@ class ImageViewer(QGraphicsView):
 
         self.remove_merged_mask_entries(merged_key)
         self.remove_group(group)
-        self.refresh_scene()
+        self.refresh_scene(self.get_items_by_ids(group["mask_ids"]))
 
     def disconnect_group(self, group):
         """Disconnect all masks in a group and restore them individually."""
@@ -664,17 +737,19 @@ class ImageViewer(QGraphicsView):
             self.restore_individual_mask(mid)
 
         self.remove_group(group)
-        self.refresh_scene()
+        self.refresh_scene(self.get_items_by_ids(group["mask_ids"]))
 
     def get_merged_key_from_group(self, group):
         """Generate a key to identify the merged mask from a group."""
-        label_names = sorted(
-            str(self.get_item_by_id(mid).label)
-            for mid in group["mask_ids"]
-            if self.get_item_by_id(mid)
-        )
+        # Groups are replaced rather than edited when masks are merged, so the key can be cached on the group
+        if "merged_key" in group:
+            return group["merged_key"]
+
+        items = (self.get_item_by_id(mid) for mid in group["mask_ids"])
+        label_names = sorted(str(item.label) for item in items if item)
         name = next(iter(group["mask_ids"])).split("_")[0]
-        return f"{name}_({','.join(label_names)})"
+        group["merged_key"] = f"{name}_({','.join(label_names)})"
+        return group["merged_key"]
 
     def remove_merged_mask_entries(self, merged_key):
         """Remove merged mask metadata from internal tracking dictionaries."""
@@ -687,7 +762,7 @@ class ImageViewer(QGraphicsView):
         if not item:
             return
 
-        key = f"{item.name}_{item.label}"
+        key = item.mask_id
         cached = self.pre_merge_callback_state.get(key)
         self.callback_dict[key] = {
             "name": item.name,
@@ -698,6 +773,8 @@ class ImageViewer(QGraphicsView):
 
         self.new_mask_dict[key] = {
             "mask": item.binary_mask,
+            "bbox": item.bbox,
+            "shape": item.image_shape,
             "source": "disconnect",
             "image_name": item.name,
             "label_group": [str(item.label)],
@@ -711,30 +788,42 @@ class ImageViewer(QGraphicsView):
 
     def remove_group(self, group):
         """Remove a mask group from tracking."""
-        if group in self.connected_groups:
-            self.connected_groups.remove(group)
+        self.connected_groups.pop(id(group), None)
+
+    def refresh_scene(self, items=None):
+        """
+        Force a refresh of the scene and viewport to reflect changes.
+        If items are given, only the area they cover is repainted.
+        """
+        if items is None:
+            self.scene().update()
+            self.viewport().update()
+            return
 
-    def refresh_scene(self):
-        """Force a refresh of the scene and viewport to reflect changes."""
-        self.scene().update()
-        self.viewport().update()
+        dirty = QRectF()
+        for item in items:
+            dirty = dirty.united(item.sceneBoundingRect())
+        if not dirty.isEmpty():
+            self.scene().update(dirty)
 
     def recolor_mask(self, mask_item_to_update, color):
         """Apply a new color to the mask item and update its pixmap."""
-        for mask_data in self.original_masks:
-            if mask_data["image_name"] == mask_item_to_update.name and mask_data["label"] == mask_item_to_update.label:
-                binary_mask = mask_data["mask"]
-                rgba_color = (color[0], color[1], color[2], 200)  # force alpha to 200
-                new_pixmap = self.convert_mask_to_pixmap(binary_mask, rgba_color)
-                 # Resize pixmap to match base image dimensions
-                scaled_pixmap = new_pixmap.scaled(
-                    self.pixmap_item.pixmap().width(),
-                    self.pixmap_item.pixmap().height(),
-                    Qt.AspectRatioMode.KeepAspectRatio,
-                    Qt.TransformationMode.SmoothTransformation
-                )
-                mask_item_to_update.setPixmap(scaled_pixmap)
-                return
+        name, label = mask_item_to_update.name, mask_item_to_update.label
+        mask_data = self.original_mask_by_key.get((name, label))
+        if mask_data is None:
+            return
+
+        rgba_color = (color[0], color[1], color[2], 200)  # force alpha to 200
+        # Masks switch back and forth between their own and merged colors, so reuse earlier pixmaps
+        cache_key = (name, label, rgba_color)
+        new_pixmap = self.recolored_pixmaps.get(cache_key)
+        if new_pixmap is None:
+            # The item's transform already scales and places the pixmap over the base image
+            new_pixmap = self.convert_mask_to_pixmap(mask_data["mask"], rgba_color)
+            self.recolored_pixmaps[cache_key] = new_pixmap
+        elif mask_item_to_update.pixmap().cacheKey() == new_pixmap.cacheKey():
+            return # Already showing this color; avoid a needless repaint
+        mask_item_to_update.setPixmap(new_pixmap)
 
     def set_togglable_masks(self, masks, colors, pixmap, font_size, show_labels=False):
         """
@@ -744,73 +833,83 @@ class ImageViewer(QGraphicsView):
         for item in self.mask_items:
             self.graphics_scene.removeItem(item)
         self.mask_items.clear()
+        self.items_by_id.clear()
         self.connected_groups.clear()
         self.mask_id_to_group.clear()
+        # Scale factors between the full image and the displayed pixmap, per image shape
+        scales_by_shape = {}
+        # One font shared by all labels
+        label_font = QFont("Arial", font_size if font_size is not None else 12)
+        label_font.setWeight(QFont.Weight.Bold)
         # Add and register new masks
-        for i, mask_data in enumerate(masks):
+        for mask_data, color in zip(masks, colors):
             label = mask_data["label"]
             name = mask_data["image_name"]
-            mask = mask_data["mask"]  # 2D numpy binary mask
-            color = colors[i]
+            mask = mask_data["mask"]  # 2D numpy binary mask, cropped to the object's bounding box
+            bbox = mask_data.get("bbox") or (0, 0, *mask.shape)
+            image_shape = mask_data.get("shape", mask.shape)
 
             key = f"{name}_{label}"
-            if key not in self.callback_dict:
-                self.callback_dict[key] = {
-                    "name": name,
-                    "label": label,
-                    "is_active": True,
-                    "merged": False
-                }
-            # Convert mask to pixmap and scale it to the image size
+            self.callback_dict.setdefault(key, {
+                "name": name,
+                "label": label,
+                "is_active": True,
+                "merged": False
+            })
+            # Convert mask to pixmap; only its bounding box is rendered
             mask_pixmap = self.convert_mask_to_pixmap(mask, color)
-            scaled_pixmap = mask_pixmap.scaled(
-                pixmap.width(),
-                pixmap.height(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
+            shape_key = (image_shape[0], image_shape[1])
+            if shape_key not in scales_by_shape:
+                scaled_size = QSize(image_shape[1], image_shape[0]).scaled(pixmap.size(), Qt.AspectRatioMode.KeepAspectRatio)
+                scale_x = scaled_size.width() / image_shape[1]
+                scale_y = scaled_size.height() / image_shape[0]
+                scales_by_shape[shape_key] = (scale_x, scale_y, QTransform.fromScale(scale_x, scale_y))
+            scale_x, scale_y, mask_transform = scales_by_shape[shape_key]
 
             # Create interactive mask object
             mask_item = ClickableMask(
-                scaled_pixmap, name, label, self.mask_click_callback, binary_mask=mask,
+                mask_pixmap, name, label, self.mask_click_callback, binary_mask=mask,
                 connection_mode_getter=self.is_connection_mode,
-                viewer=self
+                viewer=self, bbox=bbox, image_shape=image_shape
             )
 
-            # Store original color and add to scene
+            # Store original color and add to scene, scaled and placed over the object's bounding box
             mask_item.default_color = color
             mask_item.setZValue(1)
-            mask_item.setPos(0, 0)
+            mask_item.setTransformationMode(Qt.TransformationMode.SmoothTransformation)
+            mask_item.setTransform(mask_transform)
+            mask_item.setPos(bbox[1] * scale_x, bbox[0] * scale_y)
             self.graphics_scene.addItem(mask_item)
             self.mask_items.append(mask_item)
-
-            if key not in self.new_mask_dict:
-                self.new_mask_dict[key] = {
-                    "mask": mask,
-                    "source": "individual",
-                    "image_name": name,
-                    "label_group": label
-                }
+            self.items_by_id.setdefault(mask_item.mask_id, mask_item)  # the first item is kept if an ID repeats
+
+            self.new_mask_dict.setdefault(key, {
+                "mask": mask,
+                "bbox": bbox,
+                "shape": image_shape,
+                "source": "individual",
+                "image_name": name,
+                "label_group": label
+            })
             # If applicable, add a label at mask centroid
             if show_labels:
-                y_coords, x_coords = np.nonzero(mask)
-                if len(x_coords) == 0 or len(y_coords) == 0:
+                # Project the crop onto its rows and columns instead of listing every pixel
+                row_counts = np.count_nonzero(mask, axis=1)
+                col_counts = np.count_nonzero(mask, axis=0)
+                pixel_count = row_counts.sum()
+                if pixel_count == 0:
                     continue  # Skip empty masks
 
-                # Compute centroid in original mask coordinates
-                centroid_x = np.mean(x_coords)
-                centroid_y = np.mean(y_coords)
+                # Compute centroid in original image coordinates
+                centroid_x = (col_counts @ np.arange(len(col_counts))) / pixel_count + bbox[1]
+                centroid_y = (row_counts @ np.arange(len(row_counts))) / pixel_count + bbox[0]
 
-                # Scale centroid to match the scaled pixmap
-                scale_x = scaled_pixmap.width() / mask.shape[1]
-                scale_y = scaled_pixmap.height() / mask.shape[0]
+                # Scale centroid to match the displayed pixmap
                 scaled_x = centroid_x * scale_x
                 scaled_y = centroid_y * scale_y
 
                 label_item = QGraphicsTextItem(str(label))
-                font = QFont("Arial", font_size if font_size is not None else 12)
-                font.setWeight(QFont.Weight.Bold)
-                label_item.setFont(font)
+                label_item.setFont(label_font)
                 label_item.setDefaultTextColor(Qt.GlobalColor.white)
                 label_item.setZValue(100)
 
@@ -822,26 +921,31 @@ class ImageViewer(QGraphicsView):
         """
         Generate distinct colors using HSV space
         """
-        colors = []
-        for i in range(num_colors):
-            hue = int((i * 360 / num_colors) % 360)  # Spread colors evenly across HSV
-            qt_color = QColor.fromHsv(hue, 255, 255, 255)  # White-tinted for better contrast
-            colors.append((qt_color.red(), qt_color.green(), qt_color.blue(), 200))  # Convert to RGBA
-        return colors
+        if num_colors <= 0:
+            return []
+        # Only 360 hues exist, so convert each one once and look the masks' hues up in that table
+        if ImageViewer.hue_table is None:
+            hue_table = np.empty((360, 4), dtype=np.int64)
+            for hue in range(360):
+                qt_color = QColor.fromHsv(hue, 255, 255, 255)  # White-tinted for better contrast
+                hue_table[hue] = (qt_color.red(), qt_color.green(), qt_color.blue(), 200)  # Convert to RGBA
+            ImageViewer.hue_table = hue_table
+
+        hues = (np.arange(num_colors) * 360 / num_colors % 360).astype(np.int64)  # Spread colors evenly across HSV
+        return [tuple(color) for color in ImageViewer.hue_table[hues].tolist()]
     
     def convert_mask_to_pixmap(self, mask, color):
         """
         Convert a NumPy mask array to a QPixmap with transparency and a unique color
         """
         height, width = mask.shape
-        # Create an RGBA image
-        colored_mask = np.zeros((height, width, 4), dtype=np.uint8)
-        colored_mask[..., 0] = color[0]  # Red
-        colored_mask[..., 1] = color[1]  # Green
-        colored_mask[..., 2] = color[2]  # Blue
-        colored_mask[..., 3] = mask * color[3]  # Alpha transparency (only for mask pixels)
+        # Pack the RGBA color into one 32-bit word (byte order R, G, B, A as Format_RGBA8888 expects)
+        packed_color = np.array(color[:4], dtype=np.uint8).view(np.uint32)[0]
+        # One 4-byte store per pixel: the color on mask pixels, fully transparent elsewhere
+        colored_mask = np.where(mask, packed_color, np.uint32(0))
 
         q_image = QImage(colored_mask.data, width, height, width * 4, QImage.Format.Format_RGBA8888)
+        # fromImage copies the pixels, so the array can be freed once this returns
         return QPixmap.fromImage(q_image)
     
     def mask_click_callback(self, name, label, is_active):